@@ -1,8 +1,10 @@
 # jokes_api.py
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, request
 from flask_cors import CORS
+import orjson
 import random
+import threading
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -51,26 +53,54 @@ JOKES = [
     }
 ]
 
+# Index of JOKES by id, plus the next id to hand out
+_JOKES_BY_ID = {joke['id']: joke for joke in JOKES}
+_NEXT_ID = max(_JOKES_BY_ID) + 1
+_jokes_lock = threading.Lock()
+
+# Helper functions
+
+def _json(data, status=200):
+    """Serialize data with orjson into a JSON response"""
+    return Response(orjson.dumps(data), status=status, mimetype='application/json')
+
+# Serialized response bodies, cleared whenever JOKES changes
+_body_cache = {}
+
+def _cached_json(key, build):
+    """Return a JSON response whose serialized body is cached under key"""
+    body = _body_cache.get(key)
+    if body is None:
+        # Build under the lock so add_joke cannot clear the cache mid-build
+        with _jokes_lock:
+            body = _body_cache.get(key)
+            if body is None:
+                body = _body_cache[key] = orjson.dumps(build())
+    return Response(body, mimetype='application/json')
+
 # Routes
 
+# API documentation, serialized once at import
+_HOME_BODY = orjson.dumps({
+    "message": "Welcome to the Jokes API!",
+    "endpoints": {
+        "/": "API documentation",
+        "/jokes": "Get all jokes",
+        "/jokes/random": "Get a random joke",
+        "/jokes/<id>": "Get a specific joke by ID",
+        "/jokes/count": "Get total number of jokes"
+    }
+})
+
 @app.route('/')
 def home():
     """Welcome endpoint with API documentation"""
-    return jsonify({
-        "message": "Welcome to the Jokes API!",
-        "endpoints": {
-            "/": "API documentation",
-            "/jokes": "Get all jokes",
-            "/jokes/random": "Get a random joke",
-            "/jokes/<id>": "Get a specific joke by ID",
-            "/jokes/count": "Get total number of jokes"
-        }
-    })
+    return Response(_HOME_BODY, mimetype='application/json')
 
 @app.route('/jokes', methods=['GET'])
 def get_all_jokes():
     """Get all jokes"""
-    return jsonify({
+    return _cached_json('jokes', lambda: {
         "count": len(JOKES),
         "jokes": JOKES
     })
@@ -79,22 +109,22 @@ def get_all_jokes():
 def get_random_joke():
     """Get a random joke"""
     joke = random.choice(JOKES)
-    return jsonify(joke)
+    return _json(joke)
 
 @app.route('/jokes/<int:joke_id>', methods=['GET'])
 def get_joke_by_id(joke_id):
     """Get a specific joke by ID"""
-    joke = next((joke for joke in JOKES if joke['id'] == joke_id), None)
+    joke = _JOKES_BY_ID.get(joke_id)
     
     if joke:
-        return jsonify(joke)
+        return _json(joke)
     else:
-        return jsonify({"error": "Joke not found"}), 404
+        return _json({"error": "Joke not found"}, 404)
 
 @app.route('/jokes/count', methods=['GET'])
 def get_joke_count():
     """Get the total number of jokes"""
-    return jsonify({"count": len(JOKES)})
+    return _cached_json('count', lambda: {"count": len(JOKES)})
 
 @app.route('/jokes', methods=['POST'])
 def add_joke():
@@ -102,26 +132,34 @@ def add_joke():
     data = request.get_json()
     
     if not data or 'setup' not in data or 'punchline' not in data:
-        return jsonify({"error": "Setup and punchline are required"}), 400
+        return _json({"error": "Setup and punchline are required"}, 400)
     
-    new_joke = {
-        "id": max(joke['id'] for joke in JOKES) + 1,
-        "setup": data['setup'],
-        "punchline": data['punchline']
-    }
+    if not isinstance(data['setup'], str) or not isinstance(data['punchline'], str):
+        return _json({"error": "Setup and punchline must be strings"}, 400)
     
-    JOKES.append(new_joke)
-    return jsonify(new_joke), 201
+    global _NEXT_ID
+    with _jokes_lock:
+        new_joke = {
+            "id": _NEXT_ID,
+            "setup": data['setup'],
+            "punchline": data['punchline']
+        }
+        _NEXT_ID += 1
+        
+        JOKES.append(new_joke)
+        _JOKES_BY_ID[new_joke['id']] = new_joke
+        _body_cache.clear()
+    return _json(new_joke, 201)
 
 # Error handlers
 
 @app.errorhandler(404)
 def not_found(error):
-    return jsonify({"error": "Endpoint not found"}), 404
+    return _json({"error": "Endpoint not found"}, 404)
 
 @app.errorhandler(500)
 def internal_error(error):
-    return jsonify({"error": "Internal server error"}), 500
+    return _json({"error": "Internal server error"}, 500)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -1,10 +1,13 @@
 # jokes_api.py
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, request
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import orjson
+import queue
 import random
 import sqlite3
 import os
@@ -12,10 +15,12 @@ import os
 app = Flask(__name__)
 CORS(app)
 
-# Rate limiting
+# Rate limiting, shared across workers when pointed at Redis
+# (e.g. RATELIMIT_STORAGE_URI=redis://localhost:6379/0)
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
+    storage_uri=os.environ.get('RATELIMIT_STORAGE_URI', 'memory://'),
     default_limits=["200 per day", "50 per hour"]
 )
 
@@ -34,6 +39,9 @@ def init_db():
         os.remove(DATABASE)
     
     db = get_db()
+    
+    # Seed in a single transaction without fsyncs
+    db.executescript('PRAGMA synchronous = OFF; PRAGMA journal_mode = MEMORY; BEGIN;')
     cursor = db.cursor()
     
     # Create jokes table
@@ -60,15 +68,7 @@ def init_db():
     ''')
     
     # Create favorites table (for tracking user favorites)
-    cursor.execute('''
-        CREATE TABLE favorites (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            joke_id INTEGER,
-            user_ip TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (joke_id) REFERENCES jokes (id)
-        )
-    ''')
+    _create_favorites_table(cursor, 'favorites')
     
     # Insert categories
     categories = [
@@ -109,52 +109,263 @@ def init_db():
         sample_jokes
     )
     
+    _migrate_schema(cursor)
     db.commit()
+    
+    # WAL lets readers keep going while a write is in progress
+    db.execute('PRAGMA journal_mode = WAL')
     db.close()
     print("Database initialized successfully!")
 
-# Initialize database on first run
+def _create_favorites_table(cursor, name):
+    """Create a favorites table whose rows go away with their joke"""
+    cursor.execute(f'''
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            joke_id INTEGER,
+            user_ip TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (joke_id) REFERENCES jokes (id) ON DELETE CASCADE
+        )
+    ''')
+
+def migrate_db():
+    """Bring an existing database up to the current schema"""
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    _migrate_schema(db.cursor())
+    db.commit()
+    db.execute('PRAGMA journal_mode = WAL')
+    db.close()
+
+def _migrate_schema(cursor):
+    """Create the indexes, full-text table and triggers missing from the database,
+    and rebuild tables whose constraints have changed"""
+    # Create indexes for category filters and sort keys
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS idx_jokes_category ON jokes (category)',
+        'CREATE INDEX IF NOT EXISTS idx_jokes_rating ON jokes (rating DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_jokes_votes ON jokes (votes DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_jokes_created ON jokes (created_at DESC)'
+    ):
+        cursor.execute(statement)
+    
+    # Version counter bumped by every write to jokes, used to expire cached payloads
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO cache_version (id, version) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS jokes_version_{event.lower()} AFTER {event} ON jokes BEGIN
+                UPDATE cache_version SET version = version + 1;
+            END
+        ''')
+    
+    # Rebuild favorites created without the cascading foreign key, dropping
+    # duplicates and favorites of jokes that were deleted in the meantime
+    cursor.execute('PRAGMA foreign_key_list(favorites)')
+    if any(row['on_delete'] != 'CASCADE' for row in cursor.fetchall()):
+        _create_favorites_table(cursor, 'favorites_new')
+        cursor.execute('''
+            INSERT INTO favorites_new (id, joke_id, user_ip, created_at)
+            SELECT MIN(id), joke_id, user_ip, MIN(created_at)
+            FROM favorites
+            WHERE joke_id IN (SELECT id FROM jokes)
+            GROUP BY user_ip, joke_id
+        ''')
+        cursor.execute('DROP TABLE favorites')
+        cursor.execute('ALTER TABLE favorites_new RENAME TO favorites')
+    
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_fav_user_joke ON favorites (user_ip, joke_id)')
+    
+    # Create full-text index over jokes, kept in sync by triggers
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'jokes_fts'")
+    fts_exists = cursor.fetchone() is not None
+    
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS jokes_fts USING fts5(
+            setup,
+            punchline,
+            content='jokes',
+            content_rowid='id'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS jokes_ai AFTER INSERT ON jokes BEGIN
+            INSERT INTO jokes_fts (rowid, setup, punchline)
+            VALUES (new.id, new.setup, new.punchline);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS jokes_ad AFTER DELETE ON jokes BEGIN
+            INSERT INTO jokes_fts (jokes_fts, rowid, setup, punchline)
+            VALUES ('delete', old.id, old.setup, old.punchline);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS jokes_au AFTER UPDATE OF setup, punchline ON jokes BEGIN
+            INSERT INTO jokes_fts (jokes_fts, rowid, setup, punchline)
+            VALUES ('delete', old.id, old.setup, old.punchline);
+            INSERT INTO jokes_fts (rowid, setup, punchline)
+            VALUES (new.id, new.setup, new.punchline);
+        END
+    ''')
+    
+    # Index the jokes that were stored before the full-text table existed
+    if not fts_exists:
+        cursor.execute("INSERT INTO jokes_fts (jokes_fts) VALUES ('rebuild')")
+
+class SQLitePool:
+    """Pool of long-lived database connections shared across requests"""
+    
+    # journal_mode persists in the database file, the rest are per connection
+    PRAGMAS = '''
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = NORMAL;
+        PRAGMA wal_autocheckpoint = 1000;
+        PRAGMA temp_store = MEMORY;
+        PRAGMA mmap_size = 268435456;
+        PRAGMA cache_size = -20000;
+        PRAGMA foreign_keys = ON;
+    '''
+    
+    def __init__(self, path, size=8):
+        self.path = path
+        self._idle = queue.Queue(maxsize=size)
+    
+    def _connect(self):
+        """Open a new autocommit connection with tuned pragmas"""
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.executescript(self.PRAGMAS)
+        return db
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool, opening one if none is idle"""
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            db = self._connect()
+        
+        try:
+            yield db
+        finally:
+            try:
+                self._idle.put_nowait(db)
+            except queue.Full:
+                db.close()
+
+# Initialize database on first run, otherwise bring its schema up to date
 if not os.path.exists(DATABASE):
     init_db()
+else:
+    migrate_db()
+
+pool = SQLitePool(DATABASE)
 
 # Helper functions
 
-def dict_from_row(row):
-    """Convert database row to dictionary"""
-    return dict(zip(row.keys(), row))
+def _dumps(data):
+    """Serialize data with orjson, emitting sqlite3.Row objects as dicts"""
+    return orjson.dumps(data, default=dict)
+
+def _json(data, status=200):
+    """Serialize data with orjson into a JSON response"""
+    return Response(_dumps(data), status=status, mimetype='application/json')
+
+def _timestamp():
+    """Current UTC time in the format of SQLite's CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+# Cached payloads, tagged with the cache_version they were built from. The
+# version is kept in the database, so a write from any worker invalidates them
+_cache = {}
+
+def _cached(db, key, build):
+    """Return the cached value for key, rebuilding it if the data has changed"""
+    version = db.execute('SELECT version FROM cache_version').fetchone()[0]
+    entry = _cache.get(key)
+    if entry is None or entry[0] != version:
+        entry = _cache[key] = (version, build())
+    return entry[1]
+
+def _cached_json(key, build):
+    """Return a JSON response whose serialized body is cached under key"""
+    with pool.connection() as db:
+        body = _cached(db, key, lambda: _dumps(build(db)))
+    return Response(body, mimetype='application/json')
+
+# Categories are only written by init_db(), so their names are loaded once
+_category_name_set = None
+
+def _category_names(db):
+    """Return the set of known category names"""
+    global _category_name_set
+    if _category_name_set is None:
+        _category_name_set = frozenset(row[0] for row in db.execute('SELECT name FROM categories'))
+    return _category_name_set
+
+# Accepted values for the /jokes sort and order parameters
+_ALLOWED_SORTS = frozenset(('rating', 'votes', 'created_at', 'id'))
+_ALLOWED_ORDERS = frozenset(('ASC', 'DESC'))
+
+# /jokes statements for every sort, order and category filter combination,
+# so each one is prepared once per connection and reused from its cache
+_WHERE_CATEGORY = {False: '', True: ' WHERE category = ?'}
+_LIST_QUERIES = {
+    (sort_by, order, filtered): (
+        f'SELECT *, COUNT(*) OVER () as _total FROM jokes{_WHERE_CATEGORY[filtered]}'
+        f' ORDER BY {sort_by} {order} LIMIT ? OFFSET ?'
+    )
+    for sort_by in _ALLOWED_SORTS
+    for order in _ALLOWED_ORDERS
+    for filtered in (False, True)
+}
+_COUNT_QUERIES = {
+    filtered: f'SELECT COUNT(*) FROM jokes{where}'
+    for filtered, where in _WHERE_CATEGORY.items()
+}
 
 # Routes
 
+# API documentation, serialized once at import
+_HOME_BODY = orjson.dumps({
+    "name": "Jokes API",
+    "version": "2.0",
+    "description": "A comprehensive jokes API for developers",
+    "endpoints": {
+        "GET /": "API documentation",
+        "GET /jokes": "Get all jokes (supports pagination, filtering, sorting)",
+        "GET /jokes/random": "Get a random joke",
+        "GET /jokes/<id>": "Get a specific joke by ID",
+        "GET /jokes/category/<category>": "Get jokes by category",
+        "GET /categories": "Get all categories",
+        "GET /stats": "Get API statistics",
+        "POST /jokes": "Add a new joke",
+        "PUT /jokes/<id>": "Update a joke",
+        "DELETE /jokes/<id>": "Delete a joke",
+        "POST /jokes/<id>/rate": "Rate a joke (1-5)",
+        "POST /jokes/<id>/favorite": "Mark joke as favorite",
+        "GET /favorites": "Get user's favorite jokes"
+    },
+    "query_parameters": {
+        "page": "Page number (default: 1)",
+        "per_page": "Items per page (default: 10, max: 100)",
+        "category": "Filter by category",
+        "sort": "Sort by: rating, votes, created_at (default: created_at)",
+        "order": "Order: asc, desc (default: desc)"
+    }
+})
+
 @app.route('/')
 def home():
     """API documentation"""
-    return jsonify({
-        "name": "Jokes API",
-        "version": "2.0",
-        "description": "A comprehensive jokes API for developers",
-        "endpoints": {
-            "GET /": "API documentation",
-            "GET /jokes": "Get all jokes (supports pagination, filtering, sorting)",
-            "GET /jokes/random": "Get a random joke",
-            "GET /jokes/<id>": "Get a specific joke by ID",
-            "GET /jokes/category/<category>": "Get jokes by category",
-            "GET /categories": "Get all categories",
-            "GET /stats": "Get API statistics",
-            "POST /jokes": "Add a new joke",
-            "PUT /jokes/<id>": "Update a joke",
-            "DELETE /jokes/<id>": "Delete a joke",
-            "POST /jokes/<id>/rate": "Rate a joke (1-5)",
-            "POST /jokes/<id>/favorite": "Mark joke as favorite",
-            "GET /favorites": "Get user's favorite jokes"
-        },
-        "query_parameters": {
-            "page": "Page number (default: 1)",
-            "per_page": "Items per page (default: 10, max: 100)",
-            "category": "Filter by category",
-            "sort": "Sort by: rating, votes, created_at (default: created_at)",
-            "order": "Order: asc, desc (default: desc)"
-        }
-    })
+    return Response(_HOME_BODY, mimetype='application/json')
 
 @app.route('/jokes', methods=['GET'])
 @limiter.limit("100 per minute")
@@ -168,44 +379,33 @@ def get_all_jokes():
     order = request.args.get('order', 'desc', type=str).upper()
     
     # Validate sort and order
-    allowed_sorts = ['rating', 'votes', 'created_at', 'id']
-    if sort_by not in allowed_sorts:
+    if sort_by not in _ALLOWED_SORTS:
         sort_by = 'created_at'
     
-    if order not in ['ASC', 'DESC']:
+    if order not in _ALLOWED_ORDERS:
         order = 'DESC'
     
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Build query
-    query = 'SELECT * FROM jokes'
-    params = []
-    
-    if category:
-        query += ' WHERE category = ?'
-        params.append(category)
-    
-    query += f' ORDER BY {sort_by} {order}'
-    
-    # Get total count
-    count_query = 'SELECT COUNT(*) as count FROM jokes'
-    if category:
-        count_query += ' WHERE category = ?'
-        total = cursor.execute(count_query, params).fetchone()['count']
-    else:
-        total = cursor.execute(count_query).fetchone()['count']
-    
-    # Add pagination
-    offset = (page - 1) * per_page
-    query += ' LIMIT ? OFFSET ?'
-    params.extend([per_page, offset])
-    
-    cursor.execute(query, params)
-    jokes = [dict_from_row(row) for row in cursor.fetchall()]
-    db.close()
-    
-    return jsonify({
+    with pool.connection() as db:
+        cursor = db.cursor()
+        
+        # Pick the query, which counts matches over the whole result set
+        filtered = bool(category)
+        params = [category] if filtered else []
+        
+        # Add pagination
+        offset = (page - 1) * per_page
+        query = _LIST_QUERIES[sort_by, order, filtered]
+        jokes = [dict(row) for row in cursor.execute(query, params + [per_page, offset]).fetchall()]
+        
+        if jokes:
+            total = jokes[0]['_total']
+            for joke in jokes:
+                del joke['_total']
+        else:
+            # Past the last page, so the window count never arrived
+            total = cursor.execute(_COUNT_QUERIES[filtered], params).fetchone()[0]
+    
+    return _json({
         "jokes": jokes,
         "pagination": {
             "page": page,
@@ -221,46 +421,57 @@ def get_random_joke():
     """Get a random joke"""
     category = request.args.get('category', type=str)
     
-    db = get_db()
-    cursor = db.cursor()
-    
-    if category:
-        cursor.execute('SELECT * FROM jokes WHERE category = ? ORDER BY RANDOM() LIMIT 1', (category,))
-    else:
-        cursor.execute('SELECT * FROM jokes ORDER BY RANDOM() LIMIT 1')
-    
-    joke = cursor.fetchone()
-    db.close()
+    with pool.connection() as db:
+        cursor = db.cursor()
+        
+        if category:
+            # Skip a random number of rows within the category
+            counts = _cached(db, 'category_counts', lambda: dict(cursor.execute(
+                'SELECT category, COUNT(*) FROM jokes GROUP BY category'
+            ).fetchall()))
+            count = counts.get(category, 0)
+            offset = random.randrange(count) if count else 0
+            query = 'SELECT * FROM jokes WHERE category = ? LIMIT 1 OFFSET ?'
+            joke = cursor.execute(query, (category, offset)).fetchone()
+            
+            if joke is None and offset:
+                # The category shrank after the count was taken
+                joke = cursor.execute(query, (category, 0)).fetchone()
+        else:
+            # Seek to the first joke past a random point in the id range
+            cursor.execute(
+                'SELECT * FROM jokes WHERE id > CAST(? * (SELECT MAX(id) FROM jokes) AS INTEGER) ORDER BY id LIMIT 1',
+                (random.random(),)
+            )
+            joke = cursor.fetchone()
     
     if joke:
-        return jsonify(dict_from_row(joke))
+        return _json(joke)
     else:
-        return jsonify({"error": "No jokes found"}), 404
+        return _json({"error": "No jokes found"}, 404)
 
 @app.route('/jokes/<int:joke_id>', methods=['GET'])
 def get_joke_by_id(joke_id):
     """Get a specific joke by ID"""
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
-    joke = cursor.fetchone()
-    db.close()
+    with pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
+        joke = cursor.fetchone()
     
     if joke:
-        return jsonify(dict_from_row(joke))
+        return _json(joke)
     else:
-        return jsonify({"error": "Joke not found"}), 404
+        return _json({"error": "Joke not found"}, 404)
 
 @app.route('/jokes/category/<category>', methods=['GET'])
 def get_jokes_by_category(category):
     """Get jokes by category"""
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute('SELECT * FROM jokes WHERE category = ?', (category,))
-    jokes = [dict_from_row(row) for row in cursor.fetchall()]
-    db.close()
+    with pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute('SELECT * FROM jokes WHERE category = ?', (category,))
+        jokes = cursor.fetchall()
     
-    return jsonify({
+    return _json({
         "category": category,
         "count": len(jokes),
         "jokes": jokes
@@ -269,18 +480,19 @@ def get_jokes_by_category(category):
 @app.route('/categories', methods=['GET'])
 def get_categories():
     """Get all categories"""
-    db = get_db()
+    return _cached_json('categories', _load_categories)
+
+def _load_categories(db):
+    """Load all categories along with their joke counts"""
     cursor = db.cursor()
-    cursor.execute('SELECT * FROM categories')
-    categories = [dict_from_row(row) for row in cursor.fetchall()]
-    
-    # Get joke count for each category
-    for cat in categories:
-        cursor.execute('SELECT COUNT(*) as count FROM jokes WHERE category = ?', (cat['name'],))
-        cat['joke_count'] = cursor.fetchone()['count']
-    
-    db.close()
-    return jsonify(categories)
+    cursor.execute('''
+        SELECT c.id, c.name, c.description, COUNT(j.id) as joke_count
+        FROM categories c
+        LEFT JOIN jokes j ON j.category = c.name
+        GROUP BY c.id
+        ORDER BY c.id
+    ''')
+    return cursor.fetchall()
 
 @app.route('/jokes', methods=['POST'])
 @limiter.limit("10 per hour")
@@ -289,33 +501,40 @@ def add_joke():
     data = request.get_json()
     
     if not data or 'setup' not in data or 'punchline' not in data:
-        return jsonify({"error": "Setup and punchline are required"}), 400
+        return _json({"error": "Setup and punchline are required"}, 400)
     
     setup = data['setup']
     punchline = data['punchline']
     category = data.get('category', 'general')
     
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Verify category exists
-    cursor.execute('SELECT * FROM categories WHERE name = ?', (category,))
-    if not cursor.fetchone():
-        db.close()
-        return jsonify({"error": f"Category '{category}' does not exist"}), 400
-    
-    cursor.execute(
-        'INSERT INTO jokes (setup, punchline, category) VALUES (?, ?, ?)',
-        (setup, punchline, category)
-    )
-    db.commit()
+    if not all(isinstance(value, str) for value in (setup, punchline, category)):
+        return _json({"error": "Setup, punchline and category must be strings"}, 400)
     
-    joke_id = cursor.lastrowid
-    cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
-    new_joke = dict_from_row(cursor.fetchone())
-    db.close()
+    with pool.connection() as db:
+        cursor = db.cursor()
+        
+        # Verify category exists
+        if category not in _category_names(db):
+            return _json({"error": f"Category '{category}' does not exist"}, 400)
+        
+        now = _timestamp()
+        cursor.execute(
+            'INSERT INTO jokes (setup, punchline, category, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (setup, punchline, category, now, now)
+        )
+        
+        new_joke = {
+            "id": cursor.lastrowid,
+            "setup": setup,
+            "punchline": punchline,
+            "category": category,
+            "rating": 0.0,
+            "votes": 0,
+            "created_at": now,
+            "updated_at": now
+        }
     
-    return jsonify(new_joke), 201
+    return _json(new_joke, 201)
 
 @app.route('/jokes/<int:joke_id>', methods=['PUT'])
 @limiter.limit("20 per hour")
@@ -324,72 +543,69 @@ def update_joke(joke_id):
     data = request.get_json()
     
     if not data:
-        return jsonify({"error": "No data provided"}), 400
-    
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Check if joke exists
-    cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
-    if not cursor.fetchone():
-        db.close()
-        return jsonify({"error": "Joke not found"}), 404
-    
-    # Build update query
-    updates = []
-    params = []
-    
-    if 'setup' in data:
-        updates.append('setup = ?')
-        params.append(data['setup'])
-    
-    if 'punchline' in data:
-        updates.append('punchline = ?')
-        params.append(data['punchline'])
-    
-    if 'category' in data:
-        # Verify category exists
-        cursor.execute('SELECT * FROM categories WHERE name = ?', (data['category'],))
-        if not cursor.fetchone():
-            db.close()
-            return jsonify({"error": f"Category '{data['category']}' does not exist"}), 400
-        updates.append('category = ?')
-        params.append(data['category'])
-    
-    if not updates:
-        db.close()
-        return jsonify({"error": "No valid fields to update"}), 400
-    
-    updates.append('updated_at = CURRENT_TIMESTAMP')
-    params.append(joke_id)
-    
-    query = f"UPDATE jokes SET {', '.join(updates)} WHERE id = ?"
-    cursor.execute(query, params)
-    db.commit()
-    
-    cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
-    updated_joke = dict_from_row(cursor.fetchone())
-    db.close()
-    
-    return jsonify(updated_joke)
+        return _json({"error": "No data provided"}, 400)
+    
+    if not all(isinstance(data[field], str) for field in ('setup', 'punchline', 'category') if field in data):
+        return _json({"error": "Setup, punchline and category must be strings"}, 400)
+    
+    with pool.connection() as db:
+        cursor = db.cursor()
+        
+        # Check if joke exists
+        cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
+        joke = cursor.fetchone()
+        if not joke:
+            return _json({"error": "Joke not found"}, 404)
+        
+        # Build update query, applying the same changes to the response
+        updated_joke = dict(joke)
+        updates = []
+        params = []
+        
+        if 'setup' in data:
+            updates.append('setup = ?')
+            params.append(data['setup'])
+            updated_joke['setup'] = data['setup']
+        
+        if 'punchline' in data:
+            updates.append('punchline = ?')
+            params.append(data['punchline'])
+            updated_joke['punchline'] = data['punchline']
+        
+        if 'category' in data:
+            # Verify category exists
+            if data['category'] not in _category_names(db):
+                return _json({"error": f"Category '{data['category']}' does not exist"}, 400)
+            updates.append('category = ?')
+            params.append(data['category'])
+            updated_joke['category'] = data['category']
+        
+        if not updates:
+            return _json({"error": "No valid fields to update"}, 400)
+        
+        updated_joke['updated_at'] = _timestamp()
+        updates.append('updated_at = ?')
+        params.extend([updated_joke['updated_at'], joke_id])
+        
+        query = f"UPDATE jokes SET {', '.join(updates)} WHERE id = ?"
+        cursor.execute(query, params)
+    
+    return _json(updated_joke)
 
 @app.route('/jokes/<int:joke_id>', methods=['DELETE'])
 @limiter.limit("10 per hour")
 def delete_joke(joke_id):
     """Delete a joke"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
-    if not cursor.fetchone():
-        db.close()
-        return jsonify({"error": "Joke not found"}), 404
-    
-    cursor.execute('DELETE FROM jokes WHERE id = ?', (joke_id,))
-    db.commit()
-    db.close()
+    with pool.connection() as db:
+        cursor = db.cursor()
+        
+        cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
+        if not cursor.fetchone():
+            return _json({"error": "Joke not found"}, 404)
+        
+        cursor.execute('DELETE FROM jokes WHERE id = ?', (joke_id,))
     
-    return jsonify({"message": "Joke deleted successfully"}), 200
+    return _json({"message": "Joke deleted successfully"}, 200)
 
 @app.route('/jokes/<int:joke_id>/rate', methods=['POST'])
 @limiter.limit("30 per hour")
@@ -398,41 +614,38 @@ def rate_joke(joke_id):
     data = request.get_json()
     
     if not data or 'rating' not in data:
-        return jsonify({"error": "Rating is required"}), 400
+        return _json({"error": "Rating is required"}, 400)
     
     rating = data['rating']
     
     if not isinstance(rating, (int, float)) or rating < 1 or rating > 5:
-        return jsonify({"error": "Rating must be between 1 and 5"}), 400
-    
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
-    joke = cursor.fetchone()
-    
-    if not joke:
-        db.close()
-        return jsonify({"error": "Joke not found"}), 404
-    
-    # Calculate new rating
-    current_rating = joke['rating']
-    current_votes = joke['votes']
-    
-    new_votes = current_votes + 1
-    new_rating = ((current_rating * current_votes) + rating) / new_votes
-    
-    cursor.execute(
-        'UPDATE jokes SET rating = ?, votes = ? WHERE id = ?',
-        (new_rating, new_votes, joke_id)
-    )
-    db.commit()
-    
-    cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
-    updated_joke = dict_from_row(cursor.fetchone())
-    db.close()
+        return _json({"error": "Rating must be between 1 and 5"}, 400)
+    
+    with pool.connection() as db:
+        cursor = db.cursor()
+        
+        cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
+        joke = cursor.fetchone()
+        
+        if not joke:
+            return _json({"error": "Joke not found"}, 404)
+        
+        # Calculate new rating
+        updated_joke = dict(joke)
+        current_rating = updated_joke['rating']
+        current_votes = updated_joke['votes']
+        
+        new_votes = current_votes + 1
+        new_rating = ((current_rating * current_votes) + rating) / new_votes
+        
+        cursor.execute(
+            'UPDATE jokes SET rating = ?, votes = ? WHERE id = ?',
+            (new_rating, new_votes, joke_id)
+        )
+        updated_joke['rating'] = new_rating
+        updated_joke['votes'] = new_votes
     
-    return jsonify(updated_joke)
+    return _json(updated_joke)
 
 @app.route('/jokes/<int:joke_id>/favorite', methods=['POST'])
 @limiter.limit("50 per hour")
@@ -440,52 +653,41 @@ def favorite_joke(joke_id):
     """Mark a joke as favorite"""
     user_ip = get_remote_address()
     
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute('SELECT * FROM jokes WHERE id = ?', (joke_id,))
-    if not cursor.fetchone():
-        db.close()
-        return jsonify({"error": "Joke not found"}), 404
-    
-    # Check if already favorited
-    cursor.execute(
-        'SELECT * FROM favorites WHERE joke_id = ? AND user_ip = ?',
-        (joke_id, user_ip)
-    )
-    
-    if cursor.fetchone():
-        db.close()
-        return jsonify({"message": "Joke already in favorites"}), 200
-    
-    cursor.execute(
-        'INSERT INTO favorites (joke_id, user_ip) VALUES (?, ?)',
-        (joke_id, user_ip)
-    )
-    db.commit()
-    db.close()
-    
-    return jsonify({"message": "Joke added to favorites"}), 201
+    with pool.connection() as db:
+        cursor = db.cursor()
+        
+        # The unique index skips duplicates, the foreign key rejects unknown jokes
+        try:
+            cursor.execute(
+                'INSERT OR IGNORE INTO favorites (joke_id, user_ip) VALUES (?, ?)',
+                (joke_id, user_ip)
+            )
+        except sqlite3.IntegrityError:
+            return _json({"error": "Joke not found"}, 404)
+        
+        if cursor.rowcount == 0:
+            return _json({"message": "Joke already in favorites"}, 200)
+    
+    return _json({"message": "Joke added to favorites"}, 201)
 
 @app.route('/favorites', methods=['GET'])
 def get_favorites():
     """Get user's favorite jokes"""
     user_ip = get_remote_address()
     
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute('''
-        SELECT j.* FROM jokes j
-        INNER JOIN favorites f ON j.id = f.joke_id
-        WHERE f.user_ip = ?
-        ORDER BY f.created_at DESC
-    ''', (user_ip,))
-    
-    favorites = [dict_from_row(row) for row in cursor.fetchall()]
-    db.close()
-    
-    return jsonify({
+    with pool.connection() as db:
+        cursor = db.cursor()
+        
+        cursor.execute('''
+            SELECT j.* FROM jokes j
+            INNER JOIN favorites f ON j.id = f.joke_id
+            WHERE f.user_ip = ?
+            ORDER BY f.created_at DESC
+        ''', (user_ip,))
+        
+        favorites = cursor.fetchall()
+    
+    return _json({
         "count": len(favorites),
         "favorites": favorites
     })
@@ -493,24 +695,23 @@ def get_favorites():
 @app.route('/stats', methods=['GET'])
 def get_stats():
     """Get API statistics"""
-    db = get_db()
+    return _cached_json('stats', _load_stats)
+
+def _load_stats(db):
+    """Compute the statistics served by /stats"""
     cursor = db.cursor()
     
-    # Total jokes
-    cursor.execute('SELECT COUNT(*) as count FROM jokes')
-    total_jokes = cursor.fetchone()['count']
-    
-    # Total categories
-    cursor.execute('SELECT COUNT(*) as count FROM categories')
-    total_categories = cursor.fetchone()['count']
+    # Total jokes and categories
+    cursor.execute('SELECT (SELECT COUNT(*) FROM jokes), (SELECT COUNT(*) FROM categories)')
+    total_jokes, total_categories = cursor.fetchone()
     
     # Top rated jokes
     cursor.execute('SELECT * FROM jokes ORDER BY rating DESC LIMIT 5')
-    top_rated = [dict_from_row(row) for row in cursor.fetchall()]
+    top_rated = cursor.fetchall()
     
     # Most voted jokes
     cursor.execute('SELECT * FROM jokes ORDER BY votes DESC LIMIT 5')
-    most_voted = [dict_from_row(row) for row in cursor.fetchall()]
+    most_voted = cursor.fetchall()
     
     # Category distribution
     cursor.execute('''
@@ -519,17 +720,15 @@ def get_stats():
         GROUP BY category 
         ORDER BY count DESC
     ''')
-    category_dist = [dict_from_row(row) for row in cursor.fetchall()]
-    
-    db.close()
+    category_dist = cursor.fetchall()
     
-    return jsonify({
+    return {
         "total_jokes": total_jokes,
         "total_categories": total_categories,
         "top_rated_jokes": top_rated,
         "most_voted_jokes": most_voted,
         "category_distribution": category_dist
-    })
+    }
 
 @app.route('/search', methods=['GET'])
 def search_jokes():
@@ -537,21 +736,33 @@ def search_jokes():
     query = request.args.get('q', '', type=str)
     
     if not query:
-        return jsonify({"error": "Search query is required"}), 400
-    
-    db = get_db()
-    cursor = db.cursor()
-    
-    search_pattern = f'%{query}%'
-    cursor.execute('''
-        SELECT * FROM jokes 
-        WHERE setup LIKE ? OR punchline LIKE ?
-    ''', (search_pattern, search_pattern))
-    
-    results = [dict_from_row(row) for row in cursor.fetchall()]
-    db.close()
-    
-    return jsonify({
+        return _json({"error": "Search query is required"}, 400)
+    
+    with pool.connection() as db:
+        cursor = db.cursor()
+        
+        if len(query) < 2:
+            # Too short for the full-text index, fall back to a substring scan
+            search_pattern = f'%{query}%'
+            cursor.execute('''
+                SELECT * FROM jokes 
+                WHERE setup LIKE ? OR punchline LIKE ?
+                LIMIT 50
+            ''', (search_pattern, search_pattern))
+        else:
+            # Match the query as a quoted phrase whose last word is a prefix
+            match = '"' + query.replace('"', '""') + '"*'
+            cursor.execute('''
+                SELECT j.* FROM jokes_fts
+                INNER JOIN jokes j ON j.id = jokes_fts.rowid
+                WHERE jokes_fts MATCH ?
+                ORDER BY bm25(jokes_fts)
+                LIMIT 50
+            ''', (match,))
+        
+        results = cursor.fetchall()
+    
+    return _json({
         "query": query,
         "count": len(results),
         "results": results
@@ -561,15 +772,15 @@ def search_jokes():
 
 @app.errorhandler(404)
 def not_found(error):
-    return jsonify({"error": "Endpoint not found"}), 404
+    return _json({"error": "Endpoint not found"}, 404)
 
 @app.errorhandler(429)
 def ratelimit_handler(e):
-    return jsonify({"error": "Rate limit exceeded", "message": str(e.description)}), 429
+    return _json({"error": "Rate limit exceeded", "message": str(e.description)}, 429)
 
 @app.errorhandler(500)
 def internal_error(error):
-    return jsonify({"error": "Internal server error"}), 500
+    return _json({"error": "Internal server error"}, 500)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,20 @@
+# wsgi.py
+#
+# Production entry point, served by gunicorn instead of the dev server:
+#
+#     RATELIMIT_STORAGE_URI=redis://localhost:6379/0 \
+#         gunicorn -w 4 -k gevent --worker-connections 200 --preload wsgi:application
+#
+# RATELIMIT_STORAGE_URI is required with more than one worker. The memory://
+# default keeps separate counters in every worker, which silently multiplies
+# each rate limit by the worker count.
+#
+# --preload imports the app once in the master process, so the database is
+# created or migrated before the workers fork. Each worker then opens its own
+# pooled connections on first use. Workers cache /categories and /stats
+# separately, but every cached entry is checked against the cache_version
+# row in jokes.db, so a write through any worker expires all of them.
+
+from jokes_api_2 import app
+
+application = app